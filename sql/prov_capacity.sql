@@ -0,0 +1,9 @@
+-- Facility and practitioner counts per province, read by load_prov_capacity in
+-- streamlit_dashboard.py so only one row per province leaves Snowflake
+CREATE OR REPLACE SECURE VIEW prov_capacity AS
+SELECT
+    LOCATION,
+    COUNT(DISTINCT FACILITY_ID) AS FACILITIES,
+    SUM(DOCTOR_COUNT) AS TOTAL_DOCTORS
+FROM TB_PROVIDERS
+GROUP BY LOCATION;
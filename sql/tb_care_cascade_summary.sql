@@ -0,0 +1,13 @@
+-- Care cascade delays per province with the total delay precomputed by Snowflake,
+-- read by load_cascade in streamlit_dashboard.py
+CREATE OR REPLACE DYNAMIC TABLE tb_care_cascade_summary
+    TARGET_LAG = '1 hour'
+    WAREHOUSE = COMPUTE_WH
+AS
+SELECT
+    LOCATION,
+    MEDIAN_PATIENT_DELAY_DAYS,
+    MEDIAN_DIAGNOSTIC_DELAY_DAYS,
+    MEDIAN_TREATMENT_DELAY_DAYS,
+    MEDIAN_PATIENT_DELAY_DAYS + MEDIAN_DIAGNOSTIC_DELAY_DAYS + MEDIAN_TREATMENT_DELAY_DAYS AS TOTAL_DELAY_DAYS
+FROM TB_CARE_CASCADE;
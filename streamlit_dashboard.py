@@ -1,10 +1,23 @@
+import gzip
+import io
+import queue
+import re
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
+import plotly.io as pio
+import pyarrow as pa
+import pydeck as pdk
+from plotly.colors import hex_to_rgb, sample_colorscale
 import snowflake.connector
 import numpy as np
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from pathlib import Path
+
+# Copy-on-write lets read-only slices share data with their parent frame
+pd.options.mode.copy_on_write = True
 
 COLORS = {
     'primary': '#1e40af',
@@ -24,9 +37,29 @@ COLORS = {
     'text_secondary': '#475569',
 }
 
+# Shared chart styling, layered over the compact "streamlit" template Streamlit registers
+# on import, so each figure only carries its own settings
+pio.templates["tbcare"] = go.layout.Template(layout=dict(
+    paper_bgcolor='white',
+    plot_bgcolor='white',
+    font=dict(family='Inter', size=11)
+))
+pio.templates.default = "streamlit+tbcare"
+
+# Layout pieces shared by only some figures; kept out of the template because Plotly
+# embeds the template in every figure it serializes
+CENTERED_TITLE = dict(x=0.5, xanchor='center', font=dict(size=16, color=COLORS['primary'], family='Inter'))
+TOP_LEGEND = dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5)
+
+# Colour scales shared across charts
+RISK_SCALE = [[0, COLORS['success']], [0.5, COLORS['warning']], [1, COLORS['danger']]]
+STOCK_SCALE = [[0, COLORS['danger']], [0.5, COLORS['warning']], [1, COLORS['success']]]
+RATIO_SCALE = [[0, COLORS['success']], [1, COLORS['danger']]]
+# Patient, diagnostic and treatment-initiation delay stages, in cascade order
+STAGE_COLORS = [COLORS['primary'], COLORS['secondary'], COLORS['warning']]
+
 # --------- Snowflake Connection ---------
-@st.cache_resource
-def get_conn():
+def open_conn():
     return snowflake.connector.connect(
         account=st.secrets["snowflake"]["account"],
         user=st.secrets["snowflake"]["user"],
@@ -36,390 +69,702 @@ def get_conn():
         schema=st.secrets["snowflake"]["schema"],
     )
 
-@st.cache_data(ttl=300)  # Cache for 5 minutes (Dynamic Tables refresh hourly)
-def load_stock_health():
-    """Load pre-calculated stock health metrics from Dynamic Table"""
-    conn = get_conn()
-    return pd.read_sql("SELECT * FROM stock_health_summary;", conn)
+@st.cache_resource
+def get_pool():
+    """Process-wide queue of connection slots shared by all sessions; slots start empty and connect on first use"""
+    pool = queue.Queue()
+    for _ in range(int(st.secrets["snowflake"].get("pool_size", 4))):
+        pool.put(None)
+    return pool
+
+@contextmanager
+def pooled_conn():
+    """Borrow a connection from the pool, blocking while all are in use and reconnecting closed ones"""
+    pool = get_pool()
+    conn = pool.get()
+    try:
+        if conn is None or conn.is_closed():
+            conn = open_conn()
+        yield conn
+    finally:
+        # A failed connect hands back the empty slot so the pool never shrinks
+        pool.put(conn)
+
+# Columns of stock_health_summary referenced by the dashboard
+STOCK_HEALTH_COLUMNS = [
+    "DATE", "LOCATION", "ITEM", "TB_CASES_ACTIVE", "CLOSING_STOCK", "LEAD_TIME_DAYS",
+    "TB_RISK_SCORE", "DAYS_OF_THERAPY_LEFT", "STOCK_RISK_FLAG", "PROGRAMMATIC_RISK",
+    "DAYS_UNTIL_STOCKOUT_VS_LEAD", "SUGGESTED_REORDER_QTY",
+]
+
+# Columns of tb_care_cascade_summary and TB_PROVIDERS referenced by the dashboard
+DELAY_COLUMNS = ["MEDIAN_PATIENT_DELAY_DAYS", "MEDIAN_DIAGNOSTIC_DELAY_DAYS", "MEDIAN_TREATMENT_DELAY_DAYS"]
+CASCADE_COLUMNS = ["LOCATION", *DELAY_COLUMNS, "TOTAL_DELAY_DAYS"]
+PROVIDER_COLUMNS = ["FACILITY_ID", "FACILITY_NAME", "LOCATION", "DOCTOR_COUNT", "INCENTIVE_SCHEME"]
+# Above this many province x regimen cells the heatmap labels are unreadable and only bloat the payload
+HEATMAP_LABEL_MAX_CELLS = 150
+# Tables longer than this are shown one window at a time
+DATAFRAME_PAGE_ROWS = 200
+
+def downcast_numeric(df, int_columns=(), float_columns=()):
+    """Narrow integer columns to the smallest integer dtype and float columns to float32"""
+    for col in int_columns:
+        df[col] = pd.to_numeric(df[col], downcast="integer")
+    for col in float_columns:
+        df[col] = pd.to_numeric(df[col], downcast="float")
+    return df
+
+def run_query(sql, params=None):
+    """Execute a query and convert its Arrow result set to pandas without per-row Python objects"""
+    with pooled_conn() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(sql, params)
+            # split_blocks/self_destruct hand each Arrow column to pandas and free it as it goes
+            table = cur.fetch_arrow_all(force_return_table=True)
+        finally:
+            cur.close()
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+def run_row_query(sql, params=None):
+    """Execute a single-row aggregate query and return it as a dict keyed by column name, skipping pandas"""
+    with pooled_conn() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(sql, params)
+            row = cur.fetchone()
+            return dict(zip((col[0] for col in cur.description), row))
+        finally:
+            cur.close()
+
+@st.cache_data(ttl=300, show_spinner=False)  # Cache for 5 minutes (Dynamic Tables refresh hourly)
+def load_latest_stock_health():
+    """Load the latest pre-calculated stock health row per province and regimen from Dynamic Table"""
+    df = run_query(
+        f"SELECT {', '.join(STOCK_HEALTH_COLUMNS)} FROM stock_health_summary "
+        "QUALIFY ROW_NUMBER() OVER (PARTITION BY LOCATION, ITEM ORDER BY DATE DESC) = 1;"
+    )
+    df["LOCATION"] = df["LOCATION"].astype("category")
+    df["ITEM"] = df["ITEM"].astype("category")
+    return downcast_numeric(
+        df,
+        int_columns=["CLOSING_STOCK", "LEAD_TIME_DAYS", "TB_CASES_ACTIVE"],
+        float_columns=[
+            "TB_RISK_SCORE", "DAYS_OF_THERAPY_LEFT", "PROGRAMMATIC_RISK",
+            "DAYS_UNTIL_STOCKOUT_VS_LEAD", "SUGGESTED_REORDER_QTY"
+        ]
+    )
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_stock_health_stats():
+    """Load record count, province count and last update date of the stock health Dynamic Table"""
+    return run_row_query(
+        "SELECT COUNT(*) AS TOTAL_RECORDS, COUNT(DISTINCT LOCATION) AS PROVINCES, MAX(DATE) AS LAST_UPDATED "
+        "FROM stock_health_summary;"
+    )
+
+def in_list(values):
+    """Bound-parameter placeholder list for an IN (...) predicate"""
+    return ", ".join(["%s"] * len(values))
 
-@st.cache_data(ttl=300)
+@st.cache_data(ttl=300, show_spinner=False)
 def load_critical_alerts():
     """Load pre-calculated critical alerts from Dynamic Table"""
-    conn = get_conn()
-    return pd.read_sql("SELECT * FROM critical_alerts_live;", conn)
+    return run_query("SELECT * FROM critical_alerts_live;")
 
-@st.cache_data(ttl=300)
+@st.cache_data(ttl=300, show_spinner=False)
 def load_provincial_summary():
     """Load pre-calculated provincial metrics from Dynamic Table"""
-    conn = get_conn()
-    return pd.read_sql("SELECT * FROM provincial_stock_summary;", conn)
+    return run_query("SELECT * FROM provincial_stock_summary;")
 
-@st.cache_data
+@st.cache_data(ttl=300, show_spinner=False)
 def load_cascade():
-    conn = get_conn()
-    return pd.read_sql("SELECT * FROM TB_CARE_CASCADE;", conn)
+    """Load care cascade delays with the total delay pre-summed by Dynamic Table (sql/tb_care_cascade_summary.sql)"""
+    df = run_query(f"SELECT {', '.join(CASCADE_COLUMNS)} FROM tb_care_cascade_summary;")
+    df["LOCATION"] = df["LOCATION"].astype("category")
+    # float32 delay columns halve the Arrow payload of the delay table
+    return downcast_numeric(df, float_columns=[*DELAY_COLUMNS, "TOTAL_DELAY_DAYS"])
 
-@st.cache_data
+@st.cache_data(ttl=600, show_spinner=False)  # Raw tables change rarely; refresh every 10 minutes
 def load_providers():
-    conn = get_conn()
-    return pd.read_sql("SELECT * FROM TB_PROVIDERS;", conn)
+    df = run_query(f"SELECT {', '.join(PROVIDER_COLUMNS)} FROM TB_PROVIDERS;")
+    df["LOCATION"] = df["LOCATION"].astype("category")
+    df["INCENTIVE_SCHEME"] = df["INCENTIVE_SCHEME"].astype("category")
+    return downcast_numeric(df, int_columns=["DOCTOR_COUNT"])
 
-@st.cache_data
+# Same 10-minute TTL as load_providers, which reads the same raw table for the facility list,
+# so the capacity counts and the listing refresh together; provider_summary's shorter TTL
+# follows the stock health rows it also joins, and re-reads this cache in between
+@st.cache_data(ttl=600, max_entries=32, show_spinner=False)
+def load_prov_capacity(locations):
+    """Facility and practitioner counts of the selected provinces, aggregated by the prov_capacity view (sql/prov_capacity.sql)"""
+    if not locations:
+        return pd.DataFrame(columns=["facilities", "total_doctors"], index=pd.Index([], name="LOCATION"))
+    df = run_query(
+        'SELECT LOCATION, FACILITIES AS "facilities", TOTAL_DOCTORS AS "total_doctors" FROM prov_capacity '
+        f"WHERE LOCATION IN ({in_list(locations)}) ORDER BY LOCATION;",
+        locations
+    )
+    return df.set_index("LOCATION")
+
+@st.cache_data(ttl=600, show_spinner=False)
 def load_depots():
-    conn = get_conn()
-    return pd.read_sql("SELECT * FROM TB_DEPOTS;", conn)
+    df = run_query("SELECT * FROM TB_DEPOTS;")
+    df["LOCATION"] = df["LOCATION"].astype("category")
+    df["REGION"] = df["REGION"].astype("category")
+    df = downcast_numeric(df, int_columns=["STOCK_LEVEL"])
+    # Largest stock first, once per load; selections keep this order, so the inventory
+    # bar chart and the depot directory need no sort of their own
+    return df.sort_values("STOCK_LEVEL", ascending=False, kind="stable", ignore_index=True)
 
-# --------- Enhanced Custom CSS ---------
-st.markdown("""
-<style>
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
-    
-    .main {
-        background: linear-gradient(to bottom, #f8fafc 0%, #e2e8f0 100%);
-        font-family: 'Inter', sans-serif;
-    }
-    
-    .dashboard-header {
-        background: linear-gradient(135deg, #1e40af 0%, #0e7490 100%);
-        padding: 2.5rem 3rem;
-        border-radius: 16px;
-        margin-bottom: 2rem;
-        box-shadow: 0 10px 40px rgba(30, 64, 175, 0.2);
-        position: relative;
-        overflow: hidden;
-    }
-    
-    .dashboard-header::before {
-        content: '';
-        position: absolute;
-        top: -50%;
-        right: -10%;
-        width: 400px;
-        height: 400px;
-        background: radial-gradient(circle, rgba(255,255,255,0.1) 0%, transparent 70%);
-        border-radius: 50%;
-    }
-    
-    .dashboard-title {
-        font-size: 2.75rem;
-        font-weight: 700;
-        margin: 0;
-        color: #ffffff !important;
-        letter-spacing: -0.5px;
-        position: relative;
-        z-index: 1;
-        text-shadow: 0 2px 4px rgba(0,0,0,0.1);
-    }
-    
-    .dashboard-header h1 {
-        color: #ffffff !important;
-    }
-    
-    h1.dashboard-title {
-        color: #ffffff !important;
-    }
-    
-    .dashboard-subtitle {
-        font-size: 1.1rem;
-        margin-top: 0.75rem;
-        opacity: 0.95;
-        color: #ffffff !important;
-        font-weight: 400;
-        line-height: 1.6;
-        position: relative;
-        z-index: 1;
-    }
-    
-    .dashboard-header p {
-        color: #ffffff !important;
-    }
-    
-    p.dashboard-subtitle {
-        color: #ffffff !important;
-    }
-    
-    .dashboard-meta {
-        margin-top: 1.5rem;
-        padding-top: 1.5rem;
-        border-top: 1px solid rgba(255,255,255,0.2);
-        color: rgba(255,255,255,0.9) !important;
-        font-size: 0.9rem;
-        position: relative;
-        z-index: 1;
-    }
-    
-    .dashboard-header .dashboard-meta {
-        color: rgba(255,255,255,0.9) !important;
-    }
-    
-    .kpi-grid {
-        display: grid;
-        grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-        gap: 1.5rem;
-        margin-bottom: 2rem;
-    }
-    
-    .kpi-card {
-        background: white;
-        padding: 2rem 1.75rem;
-        border-radius: 12px;
-        border: 1px solid #e2e8f0;
-        box-shadow: 0 2px 8px rgba(0,0,0,0.04);
-        transition: all 0.3s ease;
-        position: relative;
-        overflow: hidden;
-    }
-    
-    .kpi-card:hover {
-        transform: translateY(-4px);
-        box-shadow: 0 8px 24px rgba(0,0,0,0.12);
-    }
-    
-    .kpi-card::before {
-        content: '';
-        position: absolute;
-        top: 0;
-        left: 0;
-        width: 4px;
-        height: 100%;
-        background: #1e40af;
-    }
-    
-    .kpi-card.success::before { background: #047857; }
-    .kpi-card.warning::before { background: #b45309; }
-    .kpi-card.danger::before { background: #b91c1c; }
-    
-    .kpi-label {
-        font-size: 0.75rem;
-        color: #64748b;
-        font-weight: 600;
-        text-transform: uppercase;
-        letter-spacing: 1px;
-        margin-bottom: 0.75rem;
-    }
-    
-    .kpi-value {
-        font-size: 2.5rem;
-        font-weight: 700;
-        color: #0f172a;
-        line-height: 1;
-        margin-bottom: 0.5rem;
-    }
-    
-    .kpi-change {
-        font-size: 0.875rem;
-        color: #64748b;
-        font-weight: 500;
-    }
-    
-    .section-header {
-        font-size: 1.75rem;
-        font-weight: 700;
-        color: #1e40af;
-        margin: 3rem 0 1.5rem 0;
-        padding-bottom: 1rem;
-        border-bottom: 3px solid #e2e8f0;
-        position: relative;
-    }
-    
-    .section-header::after {
-        content: '';
-        position: absolute;
-        bottom: -3px;
-        left: 0;
-        width: 80px;
-        height: 3px;
-        background: #1e40af;
-    }
-    
-    .info-box {
-        background: linear-gradient(135deg, #eff6ff 0%, #dbeafe 100%);
-        border: 1px solid #3b82f6;
-        border-left: 4px solid #1e40af;
-        border-radius: 8px;
-        padding: 1.5rem;
-        margin: 1.5rem 0;
-    }
-    
-    .info-box-title {
-        font-weight: 700;
-        color: #1e40af;
-        margin-bottom: 0.75rem;
-        font-size: 1rem;
-    }
-    
-    .info-box p {
-        margin: 0.5rem 0;
-        color: #475569;
-        line-height: 1.6;
-    }
-    
-    .info-legend {
-        display: flex;
-        gap: 1.5rem;
-        margin-top: 1rem;
-        flex-wrap: wrap;
-    }
-    
-    .legend-item {
-        display: flex;
-        align-items: center;
-        gap: 0.5rem;
-        font-size: 0.875rem;
-    }
-    
-    .legend-color {
-        width: 16px;
-        height: 16px;
-        border-radius: 3px;
-    }
-    
-    .alert {
-        padding: 1.5rem;
-        border-radius: 8px;
-        margin: 1rem 0;
-        border-left: 4px solid;
-        background: white;
-        box-shadow: 0 2px 8px rgba(0,0,0,0.06);
-    }
-    
-    .alert-critical {
-        border-left-color: #b91c1c;
-        background: linear-gradient(to right, #fef2f2 0%, white 100%);
-    }
-    
-    .alert-warning {
-        border-left-color: #b45309;
-        background: linear-gradient(to right, #fffbeb 0%, white 100%);
-    }
-    
-    .alert-success {
-        border-left-color: #047857;
-        background: linear-gradient(to right, #f0fdf4 0%, white 100%);
-    }
-    
-    .alert-title {
-        font-weight: 700;
-        font-size: 1.1rem;
-        margin-bottom: 0.75rem;
-        color: #0f172a;
-    }
-    
-    .alert-content {
-        color: #475569;
-        line-height: 1.6;
-    }
-    
-    .alert-metrics {
-        display: grid;
-        grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-        gap: 1rem;
-        margin-top: 1rem;
-        padding-top: 1rem;
-        border-top: 1px solid #e2e8f0;
-    }
-    
-    .alert-metric {
-        font-size: 0.875rem;
-    }
-    
-    .alert-metric-label {
-        color: #64748b;
-        font-weight: 500;
-    }
-    
-    .alert-metric-value {
-        color: #0f172a;
-        font-weight: 700;
-        font-size: 1rem;
-    }
-    
-    .stTabs [data-baseweb="tab-list"] {
-        gap: 0.5rem;
-        background: white;
-        padding: 0.75rem;
-        border-radius: 12px;
-        box-shadow: 0 2px 8px rgba(0,0,0,0.04);
-        border: 1px solid #e2e8f0;
-    }
-    
-    .stTabs [data-baseweb="tab"] {
-        height: 3.5rem;
-        padding: 0 2rem;
-        background: transparent;
-        border-radius: 8px;
-        color: #64748b;
-        font-weight: 600;
-        font-size: 0.95rem;
-        border: none;
-    }
-    
-    .stTabs [aria-selected="true"] {
-        background: linear-gradient(135deg, #1e40af 0%, #0e7490 100%);
-        color: white;
-        box-shadow: 0 4px 12px rgba(30, 64, 175, 0.3);
-    }
-    
-    .sidebar-header {
-        font-size: 1.25rem;
-        font-weight: 700;
-        color: #1e40af;
-        margin-bottom: 1.5rem;
-        padding-bottom: 0.75rem;
-        border-bottom: 2px solid #e2e8f0;
-    }
-    
-    .sidebar-section {
-        margin-bottom: 2rem;
-    }
-    
-    .sidebar-label {
-        font-size: 0.875rem;
-        font-weight: 600;
-        color: #475569;
-        margin-bottom: 0.5rem;
-    }
-    
-    .stats-card {
-        background: white;
-        padding: 1.5rem;
-        border-radius: 12px;
-        border: 1px solid #e2e8f0;
-        margin: 1rem 0;
-    }
-    
-    .stats-title {
-        font-weight: 600;
-        color: #475569;
-        font-size: 0.875rem;
-        margin-bottom: 1rem;
-    }
-    
-    .stats-grid {
-        display: grid;
-        grid-template-columns: repeat(2, 1fr);
-        gap: 1rem;
+def category_sums(column, values):
+    """Per-category totals of values over the observed categories, summed with bincount on the codes"""
+    codes = column.cat.codes.to_numpy()
+    valid = codes >= 0
+    n_categories = len(column.cat.categories)
+    observed = np.bincount(codes[valid], minlength=n_categories) > 0
+    # NULL values are skipped like groupby().sum() does; one NaN weight would make the whole
+    # category total NaN, and the int64 cast below would turn that into the int64 minimum
+    weights = values.to_numpy(dtype=np.float64)
+    summed = valid & ~np.isnan(weights)
+    totals = np.bincount(codes[summed], weights=weights[summed], minlength=n_categories)
+    return pd.Series(
+        totals[observed].astype(np.int64),
+        index=column.cat.categories[observed],
+        name=values.name
+    )
+
+def arrow_table(df):
+    """Arrow form of a cached frame, handed to st.dataframe so it isn't converted again on every rerun"""
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+def page_rows(df, key):
+    """Window of at most DATAFRAME_PAGE_ROWS rows of a frame or Arrow table, picked with a start-row slider"""
+    if len(df) <= DATAFRAME_PAGE_ROWS:
+        return df
+    start = st.slider(
+        "Start row",
+        min_value=0,
+        max_value=len(df) - DATAFRAME_PAGE_ROWS,
+        value=0,
+        key=key,
+        help=f"{len(df):,} rows; showing {DATAFRAME_PAGE_ROWS} at a time"
+    )
+    if isinstance(df, pa.Table):
+        return df.slice(start, DATAFRAME_PAGE_ROWS)
+    return df.iloc[start:start + DATAFRAME_PAGE_ROWS]
+
+def whole_counts(column, unit=""):
+    """Count column as display strings truncated like int(), with thousands separators and unit, for the cards"""
+    # Formatted from float rather than cast to int64, so a NULL count reads "N/A" instead of
+    # the int64 minimum, and is not disguised as a zero either
+    return [
+        "N/A" if np.isnan(value) else f"{value:,.0f}{unit}"
+        for value in np.trunc(column.to_numpy(dtype=np.float64))
+    ]
+
+def category_mask(column, selected):
+    """Boolean mask of rows whose categorical value is in selected, tested on the integer codes"""
+    codes = column.cat.categories.get_indexer(list(selected))
+    return np.isin(column.cat.codes.to_numpy(), codes[codes >= 0])
+
+@st.cache_data(ttl=300, max_entries=32, show_spinner=False)
+def filter_stock_health(locations, items):
+    """Filter latest stock health rows to the selection and derive stock status masks and counts"""
+    # Keyed on the selection tuples alone; the rows come from the loader's cache instead of
+    # being hashed as an argument on every rerun
+    latest = load_latest_stock_health()
+    # The default selection is every province and regimen; skip the mask work for those columns
+    masks = [
+        category_mask(latest[col], selected)
+        for col, selected in (("LOCATION", locations), ("ITEM", items))
+        if len(set(selected)) < len(latest[col].cat.categories)
+    ]
+    filtered = latest[np.logical_and.reduce(masks)] if masks else latest
+    
+    # Stock status masks shared by the KPI row, status chart and alert lists
+    days_vs_lead = filtered["DAYS_UNTIL_STOCKOUT_VS_LEAD"].to_numpy()
+    # A NULL flag is neither at risk nor adequate, as with the original == True / == False tests
+    risk_flag = filtered["STOCK_RISK_FLAG"]
+    stock_risk = risk_flag.to_numpy(dtype=bool, na_value=False)
+    not_adequate = risk_flag.to_numpy(dtype=bool, na_value=True)
+    stockout_mask = days_vs_lead < 0
+    warning_mask = (days_vs_lead >= 0) & stock_risk
+    
+    return {
+        "filtered": filtered,
+        "stockout_mask": stockout_mask,
+        "warning_mask": warning_mask,
+        # count_nonzero reads the existing masks without allocating a negated copy
+        "status_counts": (
+            np.count_nonzero(stockout_mask),
+            np.count_nonzero(warning_mask),
+            len(not_adequate) - np.count_nonzero(not_adequate),
+        ),
     }
-    
-    .stat-item {
-        padding: 0.75rem;
-        background: #f8fafc;
-        border-radius: 6px;
+
+@st.cache_data(ttl=300, max_entries=32, show_spinner=False)
+def kpi_summary(locations, items, risk_threshold):
+    """KPI row scalars for the selection, counted from the same rows as the status chart and alerts"""
+    view = filter_stock_health(locations, items)
+    filtered = view["filtered"]
+    return {
+        "PROVINCES": filtered["LOCATION"].nunique(),
+        "REGIMENS": filtered["ITEM"].nunique(),
+        "ACTIVE_CASES": int(filtered["TB_CASES_ACTIVE"].sum()),
+        "HIGH_RISK": np.count_nonzero(filtered["PROGRAMMATIC_RISK"].to_numpy() >= risk_threshold),
+        "STOCKOUTS": view["status_counts"][0],
     }
-    
-    .stat-label {
-        font-size: 0.75rem;
-        color: #64748b;
-        margin-bottom: 0.25rem;
+
+@st.cache_data(ttl=300, max_entries=32, show_spinner=False)
+def risk_pivot(locations, items):
+    """Province x regimen programmatic risk matrix for the selection (independent of the risk slider)"""
+    filtered = filter_stock_health(locations, items)["filtered"]
+    # One row per (LOCATION, ITEM) is guaranteed by the QUALIFY in load_latest_stock_health,
+    # so a plain reshape is enough
+    return filtered.pivot(index="LOCATION", columns="ITEM", values="PROGRAMMATIC_RISK")
+
+@st.cache_data(ttl=300, max_entries=32, show_spinner=False)
+def therapy_quartiles(locations, items):
+    """Per-province box statistics of days of therapy left, so the box plot ships five numbers per box"""
+    filtered = filter_stock_health(locations, items)["filtered"]
+    days = filtered["DAYS_OF_THERAPY_LEFT"]
+    by_location = filtered["LOCATION"]
+    stats = (
+        days.groupby(by_location, sort=False, observed=True)
+        .quantile([0.25, 0.5, 0.75])
+        .unstack()
+        # An empty selection unstacks to no columns at all
+        .reindex(columns=[0.25, 0.5, 0.75])
+        .dropna(how="all")
+        .set_axis(["q1", "median", "q3"], axis=1)
+    )
+    # Same whiskers Plotly draws from raw data: the furthest points within 1.5 IQR of the box
+    iqr = stats["q3"] - stats["q1"]
+    row_low = (stats["q1"] - 1.5 * iqr).reindex(by_location).to_numpy()
+    row_high = (stats["q3"] + 1.5 * iqr).reindex(by_location).to_numpy()
+    stats["lowerfence"] = np.minimum(
+        stats["q1"], days.where(days.to_numpy() >= row_low).groupby(by_location, observed=True).min()
+    )
+    stats["upperfence"] = np.maximum(
+        stats["q3"], days.where(days.to_numpy() <= row_high).groupby(by_location, observed=True).max()
+    )
+    return stats.astype(np.float32)
+
+@st.cache_data(ttl=300, max_entries=32, show_spinner=False)
+def cascade_summary(locations):
+    """Care cascade rows for the selected provinces with stage/total delay statistics"""
+    cascade_df = load_cascade()
+    filtered = cascade_df[category_mask(cascade_df["LOCATION"], locations)]
+    return {
+        "filtered": filtered,
+        "table": arrow_table(filtered),
+        "stage_means": (
+            np.nanmean(filtered[DELAY_COLUMNS].to_numpy(), axis=0) if len(filtered)
+            else np.full(len(DELAY_COLUMNS), np.nan)
+        ),
+        # mean, median, min, max of the total delay in one agg call
+        "total_stats": tuple(filtered["TOTAL_DELAY_DAYS"].agg(["mean", "median", "min", "max"])),
     }
-    
-    .stat-value {
-        font-size: 1.25rem;
-        font-weight: 700;
-        color: #0f172a;
+
+@st.cache_data(ttl=300, max_entries=32, show_spinner=False)
+def provider_summary(locations, items):
+    """Providers in the selected provinces and their per-province capacity against active cases"""
+    prov_df = load_providers()
+    filtered = prov_df[category_mask(prov_df["LOCATION"], locations)]
+    # Both aggregates stay indexed by LOCATION so the case totals join on the index
+    # and the frame is reset only once at the end
+    stock_filtered = filter_stock_health(locations, items)["filtered"]
+    case_totals = category_sums(stock_filtered["LOCATION"], stock_filtered["TB_CASES_ACTIVE"])
+    # Snowflake returns one row per selected province instead of every facility row
+    by_province = load_prov_capacity(locations).join(case_totals, how="left")
+    # Only divide where a province has doctors; others stay NaN (not 0 or inf) so they
+    # neither skew the colour scale nor read as "no patients". float32 is plenty for a ratio
+    doctor_totals = by_province["total_doctors"].to_numpy(dtype=np.float32)
+    patients_per_doctor = np.full(len(by_province), np.nan, dtype=np.float32)
+    np.divide(
+        by_province["TB_CASES_ACTIVE"].to_numpy(dtype=np.float32),
+        doctor_totals,
+        out=patients_per_doctor,
+        where=doctor_totals > 0
+    )
+    by_province["patients_per_doctor"] = patients_per_doctor
+    # Narrow dtypes once here so the charts and capacity table ship smaller arrays
+    by_province = downcast_numeric(by_province, int_columns=["facilities", "total_doctors", "TB_CASES_ACTIVE"])
+    by_province = by_province.reset_index()
+    return {
+        "filtered": filtered,
+        "table": arrow_table(filtered),
+        "by_province": by_province,
+        "by_province_table": arrow_table(by_province),
     }
-</style>
-""", unsafe_allow_html=True)
+
+@st.cache_data(ttl=300, max_entries=32, show_spinner=False)
+def depot_summary(locations):
+    """Depots in the selected provinces, largest stock first, and their per-region depot counts and inventory"""
+    depots_df = load_depots()
+    filtered = depots_df[category_mask(depots_df["LOCATION"], locations)].reset_index(drop=True)
+    # Kept sorted by region so the donut colours stay stable as the selection changes
+    by_region = filtered.groupby("REGION", observed=True).agg(
+        number_of_depots=("DEPOT_ID", "count"),
+        total_inventory=("STOCK_LEVEL", "sum")
+    ).reset_index().rename(columns={
+        "REGION": "Region",
+        "number_of_depots": "Number of Depots",
+        "total_inventory": "Total Inventory",
+    })
+    return {"filtered": filtered, "table": arrow_table(filtered), "by_region": by_region}
+
+@st.cache_data
+def alerts_csv(alert_export):
+    """Encode the alert export table as CSV bytes, written straight into a bytes buffer"""
+    buf = io.BytesIO()
+    alert_export.to_csv(buf, index=False, encoding="utf-8")
+    return buf.getvalue()
+
+@st.cache_data
+def alerts_csv_gz(alert_export):
+    """Gzip-compressed alert export for slow field connections"""
+    return gzip.compress(alerts_csv(alert_export), compresslevel=6)
+
+def stats_card_html(title, items):
+    """Stats card HTML for an optional title and (label, value, value class modifier) items"""
+    title_html = f'<div class="stats-title">{title}</div>' if title else ""
+    items_html = "".join(
+        f'<div class="stat-item"><div class="stat-label">{label}</div>'
+        f'<div class="stat-value{modifier}">{value}</div></div>'
+        for label, value, modifier in items
+    )
+    return f'<div class="stats-card">{title_html}<div class="stats-grid">{items_html}</div></div>'
+
+@st.cache_data
+def data_summary_html(total_records, provinces, last_updated, data_points):
+    """Sidebar Data Summary card, rebuilt only when the table statistics change"""
+    return stats_card_html(None, [
+        ("Total Records", f"{total_records:,}", ""),
+        ("Provinces", provinces, ""),
+        ("Last Updated", str(last_updated) if total_records else "N/A", " compact"),
+        ("Data Points", f"{data_points:,}", ""),
+    ])
+
+@st.cache_data
+def cascade_stats_html(total_stats):
+    """Cascade summary card for a (mean, median, min, max) total-delay tuple"""
+    labels = ["Mean Total Delay", "Median Total Delay", "Minimum Delay", "Maximum Delay"]
+    return stats_card_html("Filtered Provinces Summary", [
+        (label, f"{value:.1f}", "") for label, value in zip(labels, total_stats)
+    ])
+
+# --------- Chart Builders ---------
+# Figures depend only on the selection, so the Figure objects themselves are kept across
+# reruns (and expire with the data they were built from); st.plotly_chart only serializes
+# them and never mutates them
+@st.cache_resource(ttl=300, max_entries=32)
+def build_cascade_chart(locations):
+    """Stacked patient, diagnostic and treatment delays per province"""
+    cascade_filtered = cascade_summary(locations)["filtered"]
+    # One stage-by-column array and one shared x array feed all three stacked traces
+    stage_x = cascade_filtered["LOCATION"].to_numpy()
+    stage_delays = cascade_filtered[DELAY_COLUMNS].to_numpy(dtype=np.float32)
+    stages = [
+        ("Patient Delay", "Patient Delay"),
+        ("Diagnostic Delay", "Diagnostic Delay"),
+        ("Treatment Initiation Delay", "Treatment Delay"),
+    ]
+    fig_cascade = go.Figure(
+        data=[
+            go.Bar(
+                x=stage_x,
+                y=stage_delays[:, stage],
+                name=name,
+                marker_color=STAGE_COLORS[stage],
+                hovertemplate=f'<b>%{{x}}</b><br>{hover_label}: %{{y:.1f}} days<extra></extra>'
+            )
+            for stage, (name, hover_label) in enumerate(stages)
+        ],
+        layout=dict(
+            barmode='stack',
+            xaxis=dict(title="Province", tickangle=45),
+            yaxis_title="Delay Duration (Days)",
+            height=500,
+            title=dict(text="Care Cascade Delay Composition by Province", **CENTERED_TITLE),
+            hovermode='x unified',
+            legend=TOP_LEGEND
+        )
+    )
+    return fig_cascade
+
+@st.cache_resource(ttl=300, max_entries=32)
+def build_stage_delay_chart(locations):
+    """Average delay per care cascade stage for the selected provinces"""
+    avg_delays = pd.DataFrame({
+        'Cascade Stage': ['Patient Delay', 'Diagnostic Delay', 'Treatment Initiation'],
+        'Average Duration (Days)': cascade_summary(locations)["stage_means"]
+    })
+    
+    fig_avg = px.bar(
+        avg_delays,
+        x='Cascade Stage',
+        y='Average Duration (Days)',
+        color='Cascade Stage',
+        color_discrete_sequence=STAGE_COLORS,
+        text='Average Duration (Days)',
+        height=350
+    )
+    # Bar colours already name the stage, so the per-trace legend entries are dropped here too
+    fig_avg.update_traces(texttemplate='%{text:.1f}', textposition='outside', showlegend=False)
+    return fig_avg
+
+@st.cache_resource(ttl=300, max_entries=32)
+def build_provider_capacity_chart(locations, items):
+    """Grouped facilities vs practitioners bars per province"""
+    prov_with_cases = provider_summary(locations, items)["by_province"]
+    fig_providers = go.Figure(
+        data=[
+            go.Bar(
+                x=prov_with_cases["LOCATION"],
+                y=prov_with_cases["facilities"],
+                name="Healthcare Facilities",
+                marker_color=COLORS['primary']
+            ),
+            go.Bar(
+                x=prov_with_cases["LOCATION"],
+                y=prov_with_cases["total_doctors"],
+                name="Medical Practitioners",
+                marker_color=COLORS['success']
+            ),
+        ],
+        layout=dict(
+            barmode='group',
+            height=400,
+            xaxis=dict(title="Province", tickangle=45),
+            yaxis_title="Count",
+            legend=TOP_LEGEND
+        )
+    )
+    return fig_providers
+
+@st.cache_resource(ttl=300, max_entries=32)
+def build_patient_ratio_chart(locations, items):
+    """Patients-per-doctor bars per province, coloured by load"""
+    prov_with_cases = provider_summary(locations, items)["by_province"]
+    ratios = prov_with_cases["patients_per_doctor"].to_numpy()
+    # Bar colours are sampled here over the observed min-max range, so the trace ships one
+    # colour string per bar instead of a second numeric array plus a colour axis
+    known = ~np.isnan(ratios)
+    bar_colors = np.full(len(ratios), COLORS['neutral'], dtype=object)
+    if known.any():
+        lo, hi = ratios[known].min(), ratios[known].max()
+        scaled = (ratios[known] - lo) / (hi - lo) if hi > lo else np.zeros(known.sum())
+        bar_colors[known] = sample_colorscale(RATIO_SCALE, scaled.tolist())
+    fig_ratio = go.Figure(
+        go.Bar(
+            x=prov_with_cases["LOCATION"],
+            y=ratios,
+            marker_color=bar_colors,
+            hovertemplate='Province=%{x}<br>Ratio=%{y}<extra></extra>'
+        ),
+        layout=dict(
+            height=400,
+            showlegend=False,
+            xaxis=dict(title="Province", tickangle=45),
+            yaxis_title="Patients per Doctor",
+            margin=dict(t=60)
+        )
+    )
+    return fig_ratio
+
+@st.cache_resource(ttl=300, max_entries=32)
+def build_depot_map(locations):
+    """Depot locations as a WebGL scatter layer, sized and coloured by stock level"""
+    # Only the columns the layer and tooltip use are serialized to the browser
+    map_df = depot_summary(locations)["filtered"][
+        ["DEPOT_NAME", "LOCATION", "REGION", "STOCK_LEVEL", "LATITUDE", "LONGITUDE"]
+    ]
+    stock = map_df["STOCK_LEVEL"].to_numpy(dtype=np.float32)
+    # deck.gl takes per-point RGB and pixel radii, so the stock colour scale (over the
+    # observed range) and the area-proportional sizing are resolved here. Depots with a
+    # NULL stock level keep the neutral colour and the minimum radius
+    known = ~np.isnan(stock)
+    colors = np.tile(np.array(hex_to_rgb(COLORS['neutral'])), (len(stock), 1))
+    radii = np.zeros(len(stock))
+    if known.any():
+        lo, hi = stock[known].min(), stock[known].max()
+        scaled = (stock[known] - lo) / (hi - lo) if hi > lo else np.zeros(known.sum())
+        colors[known] = np.round(
+            np.array(sample_colorscale(STOCK_SCALE, scaled.tolist(), colortype="tuple")) * 255
+        )
+        if hi > 0:
+            radii[known] = 10 * np.sqrt(stock[known] / hi)
+    map_df = map_df.assign(
+        color=colors.tolist(),
+        radius=radii,
+        # NaN is not valid JSON, so the tooltip gets display strings instead of the raw column
+        STOCK_LEVEL=["N/A" if np.isnan(value) else f"{value:.0f}" for value in stock]
+    )
+    return pdk.Deck(
+        layers=[pdk.Layer(
+            "ScatterplotLayer",
+            data=map_df,
+            get_position=["LONGITUDE", "LATITUDE"],
+            get_fill_color="color",
+            get_radius="radius",
+            radius_units="pixels",
+            radius_min_pixels=2,
+            pickable=True,
+        )],
+        initial_view_state=pdk.ViewState(
+            latitude=float(map_df["LATITUDE"].mean()),
+            longitude=float(map_df["LONGITUDE"].mean()),
+            zoom=4
+        ),
+        tooltip={"html": "<b>{DEPOT_NAME}</b><br>STOCK_LEVEL={STOCK_LEVEL}<br>LOCATION={LOCATION}<br>REGION={REGION}"},
+        # Basemap follows the Streamlit theme and needs no Mapbox token
+        map_style=None
+    )
+
+@st.cache_resource(ttl=300, max_entries=32)
+def build_depot_stock_chart(locations):
+    """Depot inventory bars, largest first"""
+    depots_filtered = depot_summary(locations)["filtered"]
+    fig_depot_stock = px.bar(
+        depots_filtered,
+        x="DEPOT_NAME",
+        y="STOCK_LEVEL",
+        color="REGION",
+        labels={"STOCK_LEVEL": "Inventory Level (Units)", "DEPOT_NAME": "Depot Facility"},
+        height=400
+    )
+    fig_depot_stock.update_layout(xaxis_tickangle=45)
+    return fig_depot_stock
+
+@st.cache_resource(ttl=300, max_entries=32)
+def build_regional_chart(locations):
+    """Share of depots per region as a donut chart"""
+    regional_stats = depot_summary(locations)["by_region"]
+    
+    fig_regional = px.pie(
+        regional_stats,
+        values="Number of Depots",
+        names="Region",
+        hole=0.5,
+        height=400
+    )
+    fig_regional.update_traces(textposition='inside', textinfo='percent+label')
+    return fig_regional
+
+# --------- Enhanced Custom CSS ---------
+CSS_PATH = Path(__file__).parent / "assets" / "dashboard.css"
+
+def minify_css(css):
+    """Strip comments and redundant whitespace from a stylesheet and shorten #aabbcc colors"""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    css = re.sub(r"#([0-9a-fA-F])\1([0-9a-fA-F])\2([0-9a-fA-F])\3\b", r"#\1\2\3", css)
+    return css.replace(";}", "}").strip()
+
+@st.cache_resource
+def load_css():
+    """Read and minify the dashboard stylesheet once per server process"""
+    return minify_css(CSS_PATH.read_text(encoding="utf-8"))
+
+# Re-emitted on every run: Streamlit drops elements a rerun does not send again,
+# so a once-per-session guard would lose the stylesheet after the first interaction
+st.markdown(f"<style>{load_css()}</style>", unsafe_allow_html=True)
+
+# --------- Card Templates ---------
+# Parsed once at import; the KPI row and alert loops only fill in the fields
+KPI_CARD_TEMPLATE = """<div class="kpi-card{modifier}">
+<div class="kpi-label">{label}</div>
+<div class="kpi-value">{value}</div>
+<div class="kpi-change">{caption}</div>
+</div>"""
+
+@st.cache_data
+def kpi_html(provinces, regimens, active_cases, high_risk, stockouts):
+    """Whole KPI row as one HTML string; the .kpi-grid CSS rule handles the layout"""
+    kpi_cards = [
+        ("", "Provinces", f"{provinces}", "Geographic Coverage"),
+        (" success", "TB Regimens", f"{regimens}", "Treatment Options"),
+        ("", "Active Cases", f"{active_cases:,}", "Patients in Treatment"),
+        (" warning", "High-Risk Pairs", f"{high_risk}", "Requires Monitoring"),
+        (" danger", "Critical Alerts", f"{stockouts}", "Immediate Action Required"),
+    ]
+    return (
+        '<div class="kpi-grid">'
+        + "".join(
+            KPI_CARD_TEMPLATE.format(modifier=modifier, label=label, value=value, caption=caption)
+            for modifier, label, value, caption in kpi_cards
+        )
+        + '</div>'
+    )
+
+ALERT_CARD_TEMPLATE = """<div class="alert {severity_class}">
+<div class="alert-title">{severity_label}: {location} — {item}</div>
+<div class="alert-content">
+<p><strong>Stock Exhaustion Forecast:</strong> {days_short:.1f} days before next scheduled delivery</p>
+</div>
+<div class="alert-metrics">
+<div class="alert-metric">
+<div class="alert-metric-label">Current Stock</div>
+<div class="alert-metric-value">{closing_stock}</div>
+</div>
+<div class="alert-metric">
+<div class="alert-metric-label">Active Patients</div>
+<div class="alert-metric-value">{cases}</div>
+</div>
+<div class="alert-metric">
+<div class="alert-metric-label">Days Supply Left</div>
+<div class="alert-metric-value">{days_left:.1f} days</div>
+</div>
+<div class="alert-metric">
+<div class="alert-metric-label">Lead Time</div>
+<div class="alert-metric-value">{lead_time}</div>
+</div>
+<div class="alert-metric">
+<div class="alert-metric-label">TB Risk Score</div>
+<div class="alert-metric-value">{risk_score:.1f} / 10</div>
+</div>
+<div class="alert-metric">
+<div class="alert-metric-label">Recommended Order</div>
+<div class="alert-metric-value">{reorder_qty}</div>
+</div>
+</div>
+</div>
+"""
+
+WARNING_CARD_TEMPLATE = """<div class="alert alert-warning">
+<div class="alert-content">
+<strong>{location} — {item}</strong><br>
+Supply remaining: {days_left:.1f} days | 
+Lead time: {lead_time} | 
+Active cases: {cases} | 
+Recommended order: {reorder_qty}
+</div>
+</div>
+"""
+
+# --------- Static HTML ---------
+INFO_BOX_DEPOT_HTML = """<div class="info-box">
+    <div class="info-box-title">National Distribution Infrastructure</div>
+    <p>Strategic depot locations form the backbone of Indonesia's TB pharmaceutical supply chain, managing inventory flow from central procurement to provincial healthcare facilities.</p>
+</div>
+"""
+
+FOOTER_HTML = """
+<div style="text-align: center; color: #64748b; padding: 2.5rem 1rem; background: white; border-radius: 12px; margin-top: 3rem;">
+    <p style="font-size: 1.1rem; font-weight: 600; color: #1e40af; margin-bottom: 0.5rem;">TB CareMap Indonesia</p>
+    <p style="font-size: 0.9rem; margin: 0.25rem 0;">National Tuberculosis Inventory Management System</p>
+    <p style="font-size: 0.85rem; color: #94a3b8; margin-top: 1rem;">
+        Powered by Snowflake Data Cloud Platform • Built with Streamlit Framework
+    </p>
+    <p style="font-size: 0.8rem; color: #cbd5e1; margin-top: 0.75rem;">
+        Note: All displayed data is synthetic and generated for demonstration and educational purposes only
+    </p>
+</div>
+"""
 
 # --------- Page Configuration ---------
 st.set_page_config(
@@ -443,152 +788,115 @@ st.markdown(f"""
 
 # --------- Load Data ---------
 with st.spinner('Loading data from Snowflake Dynamic Tables...'):
-    stock_health_df = load_stock_health()
-    cascade_df = load_cascade()
-    prov_df = load_providers()
-    depots_df = load_depots()
-
-# Get latest data only from stock_health
-latest = stock_health_df.sort_values("DATE").groupby(["LOCATION", "ITEM"]).tail(1).copy()
+    latest = load_latest_stock_health()
+    stock_health_stats = load_stock_health_stats()
 
 # --------- Sidebar Filters ---------
+def sidebar_label(text):
+    """Caption rendered above a sidebar widget group"""
+    st.markdown(f'<p class="sidebar-label">{text}</p>', unsafe_allow_html=True)
+
+# Casting to category at load sorts the distinct values into .categories, so the
+# filter choices need no unique()/sorted() pass over the rows
+province_options = latest["LOCATION"].cat.categories.tolist()
+regimen_options = latest["ITEM"].cat.categories.tolist()
+
 with st.sidebar:
     st.markdown('<p class="sidebar-header">Filter Controls</p>', unsafe_allow_html=True)
     
-    st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
-    st.markdown('<p class="sidebar-label">Geographic Scope</p>', unsafe_allow_html=True)
-    selected_locations = st.multiselect(
-        "Select Provinces",
-        options=sorted(latest["LOCATION"].unique()),
-        default=sorted(latest["LOCATION"].unique()),
-        label_visibility="collapsed"
-    )
-    st.markdown('</div>', unsafe_allow_html=True)
+    with st.container(key="sidebar-section-geo"):
+        sidebar_label("Geographic Scope")
+        selected_locations = st.multiselect(
+            "Select Provinces",
+            options=province_options,
+            default=province_options,
+            label_visibility="collapsed"
+        )
     
-    st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
-    st.markdown('<p class="sidebar-label">Treatment Regimens</p>', unsafe_allow_html=True)
-    selected_items = st.multiselect(
-        "Select TB Regimens",
-        options=sorted(latest["ITEM"].unique()),
-        default=sorted(latest["ITEM"].unique()),
-        label_visibility="collapsed"
-    )
-    st.markdown('</div>', unsafe_allow_html=True)
+    with st.container(key="sidebar-section-regimens"):
+        sidebar_label("Treatment Regimens")
+        selected_items = st.multiselect(
+            "Select TB Regimens",
+            options=regimen_options,
+            default=regimen_options,
+            label_visibility="collapsed"
+        )
     
-    st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
-    st.markdown('<p class="sidebar-label">Risk Parameters</p>', unsafe_allow_html=True)
-    risk_threshold = st.slider(
-        "Programmatic Risk Threshold",
-        min_value=0,
-        max_value=10,
-        value=8,
-        help="Alert threshold for programmatic risk score (0-10 scale)"
-    )
-    st.markdown('</div>', unsafe_allow_html=True)
+    with st.container(key="sidebar-section-risk"):
+        sidebar_label("Risk Parameters")
+        risk_threshold = st.slider(
+            "Programmatic Risk Threshold",
+            min_value=0,
+            max_value=10,
+            value=8,
+            help="Alert threshold for programmatic risk score (0-10 scale)"
+        )
     
     st.markdown("---")
     
     st.markdown('<p class="sidebar-header">Data Summary</p>', unsafe_allow_html=True)
     
-    st.markdown(f"""
-    <div class="stats-card">
-        <div class="stats-grid">
-            <div class="stat-item">
-                <div class="stat-label">Total Records</div>
-                <div class="stat-value">{len(stock_health_df):,}</div>
-            </div>
-            <div class="stat-item">
-                <div class="stat-label">Provinces</div>
-                <div class="stat-value">{stock_health_df["LOCATION"].nunique()}</div>
-            </div>
-            <div class="stat-item">
-                <div class="stat-label">Last Updated</div>
-                <div class="stat-value" style="font-size: 0.9rem;">{str(stock_health_df["DATE"].max()) if not stock_health_df.empty else "N/A"}</div>
-            </div>
-            <div class="stat-item">
-                <div class="stat-label">Data Points</div>
-                <div class="stat-value">{len(latest):,}</div>
-            </div>
-        </div>
-    </div>
-    """, unsafe_allow_html=True)
-
-# Filter data based on selections
-filtered_latest = latest[
-    (latest["LOCATION"].isin(selected_locations)) & 
-    (latest["ITEM"].isin(selected_items))
-].copy()
-
-# --------- KPI Section ---------
-st.markdown('<h2 class="section-header">Key Performance Indicators</h2>', unsafe_allow_html=True)
+    st.markdown(
+        data_summary_html(
+            stock_health_stats["TOTAL_RECORDS"], stock_health_stats["PROVINCES"],
+            stock_health_stats["LAST_UPDATED"], len(latest)
+        ),
+        unsafe_allow_html=True
+    )
 
-col1, col2, col3, col4, col5 = st.columns(5)
+# Nothing below has anything to show without at least one province and regimen
+if not selected_locations or not selected_items:
+    st.warning("Select at least one province and one treatment regimen to display the dashboard.")
+    st.stop()
 
-with col1:
-    provinces_count = filtered_latest["LOCATION"].nunique() if len(filtered_latest) > 0 else 0
-    st.markdown(f"""
-    <div class="kpi-card">
-        <div class="kpi-label">Provinces</div>
-        <div class="kpi-value">{int(provinces_count)}</div>
-        <div class="kpi-change">Geographic Coverage</div>
-    </div>
-    """, unsafe_allow_html=True)
+# Sorted tuples are hashable and keep every selection-keyed cache independent of pick order
+selected_locations = tuple(sorted(selected_locations))
+selected_items = tuple(sorted(selected_items))
 
-with col2:
-    regimens_count = filtered_latest["ITEM"].nunique() if len(filtered_latest) > 0 else 0
-    st.markdown(f"""
-    <div class="kpi-card success">
-        <div class="kpi-label">TB Regimens</div>
-        <div class="kpi-value">{int(regimens_count)}</div>
-        <div class="kpi-change">Treatment Options</div>
-    </div>
-    """, unsafe_allow_html=True)
+# Filter data based on selections (cached per selection, so unrelated widgets reuse it)
+filtered_view = filter_stock_health(selected_locations, selected_items)
+filtered_latest = filtered_view["filtered"]
+stockout_mask = filtered_view["stockout_mask"]
+warning_mask = filtered_view["warning_mask"]
+stockout_count, warning_count, adequate_count = filtered_view["status_counts"]
 
-with col3:
-    active_cases = int(filtered_latest["TB_CASES_ACTIVE"].sum()) if len(filtered_latest) > 0 else 0
-    st.markdown(f"""
-    <div class="kpi-card">
-        <div class="kpi-label">Active Cases</div>
-        <div class="kpi-value">{active_cases:,}</div>
-        <div class="kpi-change">Patients in Treatment</div>
-    </div>
-    """, unsafe_allow_html=True)
+# --------- KPI Section ---------
+st.markdown('<h2 class="section-header">Key Performance Indicators</h2>', unsafe_allow_html=True)
 
-with col4:
-    # Filter by programmatic_risk >= risk_threshold
-    high_risk_count = int((filtered_latest["PROGRAMMATIC_RISK"] >= risk_threshold).sum()) if len(filtered_latest) > 0 else 0
-    st.markdown(f"""
-    <div class="kpi-card warning">
-        <div class="kpi-label">High-Risk Pairs</div>
-        <div class="kpi-value">{high_risk_count}</div>
-        <div class="kpi-change">Requires Monitoring</div>
-    </div>
-    """, unsafe_allow_html=True)
+# Derived from the cached latest rows, so the tiles always agree with the sections below
+kpis = kpi_summary(selected_locations, selected_items, risk_threshold)
 
-with col5:
-    # Critical = items where days_until_stockout_vs_lead < 0
-    stockout_count = int((filtered_latest["DAYS_UNTIL_STOCKOUT_VS_LEAD"] < 0).sum()) if len(filtered_latest) > 0 else 0
-    st.markdown(f"""
-    <div class="kpi-card danger">
-        <div class="kpi-label">Critical Alerts</div>
-        <div class="kpi-value">{stockout_count}</div>
-        <div class="kpi-change">Immediate Action Required</div>
-    </div>
-    """, unsafe_allow_html=True)
+# One markdown delta for the whole row, cached on the five scalars
+st.markdown(
+    kpi_html(*(int(kpis[col]) for col in ["PROVINCES", "REGIMENS", "ACTIVE_CASES", "HIGH_RISK", "STOCKOUTS"])),
+    unsafe_allow_html=True
+)
 
 st.markdown("<br>", unsafe_allow_html=True)
 
-# --------- Main Tabs ---------
-tab1, tab2, tab3, tab4, tab5 = st.tabs([
-    "Inventory Analysis", 
-    "Critical Alerts", 
-    "Care Cascade", 
+# --------- Main Sections ---------
+# A section picker rather than st.tabs: every st.tabs body runs on each rerun even while
+# hidden, whereas only the picked section is rendered (and loads its data) here
+SECTIONS = [
+    "Inventory Analysis",
+    "Critical Alerts",
+    "Care Cascade",
     "Provider Network",
-    "Distribution System"
-])
+    "Distribution System",
+]
+with st.container(key="section-nav"):
+    active_section = st.radio(
+        "Dashboard Section",
+        SECTIONS,
+        key="active_section",
+        horizontal=True,
+        label_visibility="collapsed"
+    )
 
 # --------- TAB 1: Inventory Analysis ---------
-with tab1:
+@st.fragment
+def render_inventory_tab(selected_locations, selected_items, stockout_count, warning_count, adequate_count):
+    """Risk heatmap, stock status mix and days-of-therapy distribution"""
     st.markdown('<h2 class="section-header">Inventory Health Assessment</h2>', unsafe_allow_html=True)
     
     st.markdown("""
@@ -612,125 +920,99 @@ with tab1:
     </div>
     """, unsafe_allow_html=True)
     
-    pivot = filtered_latest.pivot_table(
-        index="LOCATION",
-        columns="ITEM",
-        values="PROGRAMMATIC_RISK",
-        aggfunc="mean"
-    )
+    pivot = risk_pivot(selected_locations, selected_items)
+    # float32 halves the z payload; cell labels are formatted once in C and only sent
+    # while the matrix is small enough for them to be readable
+    risk_values = pivot.to_numpy(dtype=np.float32)
+    heatmap_labels = {}
+    if risk_values.size <= HEATMAP_LABEL_MAX_CELLS:
+        heatmap_labels = dict(
+            text=np.where(np.isnan(risk_values), "", np.char.mod("%.1f", risk_values)),
+            texttemplate="%{text}",
+            textfont={"size": 9, "color": "white"},
+        )
     
     fig = go.Figure(
         data=go.Heatmap(
-            z=pivot.values,
+            z=risk_values,
             x=pivot.columns,
             y=pivot.index,
-            colorscale=[
-                [0, COLORS['success']],
-                [0.5, COLORS['warning']],
-                [1, COLORS['danger']]
-            ],
+            colorscale=RISK_SCALE,
             colorbar=dict(
                 title=dict(text="Risk Score", font=dict(size=12)),
                 thickness=15,
                 len=0.7,
                 tickfont=dict(size=10)
             ),
-            text=np.round(pivot.values, 1),
-            texttemplate="%{text}",
-            textfont={"size": 9, "color": "white"},
             hoverongaps=False,
-            hovertemplate='<b>Province:</b> %{y}<br><b>Regimen:</b> %{x}<br><b>Risk Score:</b> %{z:.1f}<extra></extra>'
+            hovertemplate='<b>Province:</b> %{y}<br><b>Regimen:</b> %{x}<br><b>Risk Score:</b> %{z:.1f}<extra></extra>',
+            **heatmap_labels
+        ),
+        layout=dict(
+            height=550,
+            xaxis_title="Treatment Regimen",
+            yaxis_title="Province",
+            title=dict(text="Programmatic Risk Matrix: Province × Regimen", **CENTERED_TITLE),
+            font=dict(size=10),
+            margin=dict(l=150, r=50, t=80, b=80)
         )
     )
     
-    fig.update_layout(
-        height=550,
-        xaxis_title="Treatment Regimen",
-        yaxis_title="Province",
-        title={
-            'text': "Programmatic Risk Matrix: Province × Regimen",
-            'x': 0.5,
-            'xanchor': 'center',
-            'font': {'size': 16, 'color': COLORS['primary'], 'family': 'Inter'}
-        },
-        font=dict(size=10, family='Inter'),
-        plot_bgcolor='white',
-        paper_bgcolor='white',
-        margin=dict(l=150, r=50, t=80, b=80)
-    )
-    
-    st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(fig, use_container_width=True, key="inventory_heatmap")
     
     # Analytics Grid
     col1, col2 = st.columns(2)
     
     with col1:
         st.markdown("**Stock Status Distribution**")
-        status_counts = pd.DataFrame({
-            'Status': ['Critical Stockout', 'Warning Level', 'Adequate Supply'],
-            'Count': [
-                int((filtered_latest["DAYS_UNTIL_STOCKOUT_VS_LEAD"] < 0).sum()),
-                int(((filtered_latest["DAYS_UNTIL_STOCKOUT_VS_LEAD"] >= 0) & 
-                     (filtered_latest["STOCK_RISK_FLAG"] == True)).sum()),
-                int((filtered_latest["STOCK_RISK_FLAG"] == False).sum())
-            ]
-        })
-        
-        fig_pie = px.pie(
-            status_counts, 
-            values='Count', 
-            names='Status',
-            color='Status',
-            color_discrete_map={
-                'Critical Stockout': COLORS['danger'],
-                'Warning Level': COLORS['warning'],
-                'Adequate Supply': COLORS['success']
-            },
-            hole=0.5
-        )
-        fig_pie.update_traces(
-            textposition='inside', 
-            textinfo='percent+label',
-            textfont_size=11
-        )
-        fig_pie.update_layout(
-            height=400, 
-            showlegend=True,
-            paper_bgcolor='white',
-            plot_bgcolor='white',
-            font=dict(family='Inter', size=11),
-            legend=dict(orientation="v", yanchor="middle", y=0.5, xanchor="left", x=1.1)
+        # int32 counts go to the browser as a typed array rather than a JSON list
+        fig_pie = go.Figure(
+            go.Pie(
+                labels=['Critical Stockout', 'Warning Level', 'Adequate Supply'],
+                values=np.array([stockout_count, warning_count, adequate_count], dtype=np.int32),
+                marker_colors=[COLORS['danger'], COLORS['warning'], COLORS['success']],
+                hole=0.5,
+                textposition='inside',
+                textinfo='percent+label',
+                textfont_size=11,
+                hovertemplate='Status=%{label}<br>Count=%{value}<extra></extra>'
+            ),
+            layout=dict(
+                height=400,
+                margin=dict(t=60),
+                showlegend=True,
+                legend=dict(orientation="v", yanchor="middle", y=0.5, xanchor="left", x=1.1)
+            )
         )
-        st.plotly_chart(fig_pie, use_container_width=True)
+        st.plotly_chart(fig_pie, use_container_width=True, key="inventory_status_pie")
     
     with col2:
         st.markdown("**Days of Therapy Remaining Distribution**")
-        fig_box = px.box(
-            filtered_latest[filtered_latest["DAYS_OF_THERAPY_LEFT"].notna()],
-            y="DAYS_OF_THERAPY_LEFT",
-            x="LOCATION",
-            color="LOCATION",
-            labels={"DAYS_OF_THERAPY_LEFT": "Days Remaining", "LOCATION": "Province"}
-        )
-        fig_box.update_layout(
-            height=400,
-            showlegend=False,
-            yaxis_title="Days of Therapy Supply",
-            xaxis_title="",
-            paper_bgcolor='white',
-            plot_bgcolor='white',
-            font=dict(family='Inter', size=11)
+        quartiles = therapy_quartiles(selected_locations, selected_items)
+        # Single trace over all provinces, drawn from precomputed statistics instead of raw points
+        fig_box = go.Figure(
+            go.Box(
+                x=quartiles.index.to_numpy(),
+                **{stat: quartiles[stat].to_numpy() for stat in quartiles.columns},
+                name="Days Remaining",
+                marker_color=COLORS['primary']
+            ),
+            layout=dict(
+                height=400,
+                showlegend=False,
+                yaxis_title="Days of Therapy Supply",
+                xaxis=dict(title="", tickangle=45)
+            )
         )
-        fig_box.update_xaxes(tickangle=45)
-        st.plotly_chart(fig_box, use_container_width=True)
+        st.plotly_chart(fig_box, use_container_width=True, key="inventory_therapy_box")
 
 # --------- TAB 2: Critical Alerts ---------
-with tab2:
+@st.fragment
+def render_alerts_tab(filtered_latest, stockout_mask, warning_mask):
+    """Stockout alert cards, procurement export and near-threshold warnings"""
     st.markdown('<h2 class="section-header">Critical Stock Alerts and Procurement Recommendations</h2>', unsafe_allow_html=True)
     
-    alerts = filtered_latest[filtered_latest["DAYS_UNTIL_STOCKOUT_VS_LEAD"] < 0].sort_values(
-        "DAYS_UNTIL_STOCKOUT_VS_LEAD"
-    )
+    alerts = filtered_latest[stockout_mask].sort_values("DAYS_UNTIL_STOCKOUT_VS_LEAD")
     
     if alerts.empty:
         st.markdown("""
@@ -769,46 +1051,31 @@ with tab2:
         </div>
         """, unsafe_allow_html=True)
         
-        # Detailed alert cards
-        for idx, r in alerts.iterrows():
-            days_short = abs(r['DAYS_UNTIL_STOCKOUT_VS_LEAD'])
-            severity_label = "CRITICAL" if days_short > 7 else "URGENT"
-            severity_class = "alert-critical" if days_short > 7 else "alert-warning"
-            
-            st.markdown(f"""
-            <div class="alert {severity_class}">
-                <div class="alert-title">{severity_label}: {r['LOCATION']} — {r['ITEM']}</div>
-                <div class="alert-content">
-                    <p><strong>Stock Exhaustion Forecast:</strong> {days_short:.1f} days before next scheduled delivery</p>
-                </div>
-                <div class="alert-metrics">
-                    <div class="alert-metric">
-                        <div class="alert-metric-label">Current Stock</div>
-                        <div class="alert-metric-value">{int(r['CLOSING_STOCK'])} units</div>
-                    </div>
-                    <div class="alert-metric">
-                        <div class="alert-metric-label">Active Patients</div>
-                        <div class="alert-metric-value">{int(r['TB_CASES_ACTIVE'])}</div>
-                    </div>
-                    <div class="alert-metric">
-                        <div class="alert-metric-label">Days Supply Left</div>
-                        <div class="alert-metric-value">{r['DAYS_OF_THERAPY_LEFT']:.1f} days</div>
-                    </div>
-                    <div class="alert-metric">
-                        <div class="alert-metric-label">Lead Time</div>
-                        <div class="alert-metric-value">{int(r['LEAD_TIME_DAYS'])} days</div>
-                    </div>
-                    <div class="alert-metric">
-                        <div class="alert-metric-label">TB Risk Score</div>
-                        <div class="alert-metric-value">{r['TB_RISK_SCORE']:.1f} / 10</div>
-                    </div>
-                    <div class="alert-metric">
-                        <div class="alert-metric-label">Recommended Order</div>
-                        <div class="alert-metric-value">{int(r['SUGGESTED_REORDER_QTY'])} units</div>
-                    </div>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
+        # Detailed alert cards, built from column arrays and emitted in one markdown call
+        shortfall_days = np.abs(alerts["DAYS_UNTIL_STOCKOUT_VS_LEAD"].to_numpy())
+        severe = shortfall_days > 7
+        severity_labels = np.where(severe, "CRITICAL", "URGENT")
+        severity_classes = np.where(severe, "alert-critical", "alert-warning")
+        
+        alert_cards = []
+        for severity_label, severity_class, days_short, location, item, closing_stock, cases, days_left, lead_time, risk_score, reorder_qty in zip(
+            severity_labels,
+            severity_classes,
+            shortfall_days,
+            *(alerts[col].to_numpy() for col in ["LOCATION", "ITEM"]),
+            whole_counts(alerts["CLOSING_STOCK"], " units"),
+            whole_counts(alerts["TB_CASES_ACTIVE"]),
+            alerts["DAYS_OF_THERAPY_LEFT"].to_numpy(),
+            whole_counts(alerts["LEAD_TIME_DAYS"], " days"),
+            alerts["TB_RISK_SCORE"].to_numpy(),
+            whole_counts(alerts["SUGGESTED_REORDER_QTY"], " units"),
+        ):
+            alert_cards.append(ALERT_CARD_TEMPLATE.format(
+                severity_class=severity_class, severity_label=severity_label, location=location, item=item,
+                days_short=days_short, closing_stock=closing_stock, cases=cases, days_left=days_left,
+                lead_time=lead_time, risk_score=risk_score, reorder_qty=reorder_qty,
+            ))
+        st.markdown("".join(alert_cards), unsafe_allow_html=True)
         
         st.markdown("---")
         st.markdown("**Comprehensive Alert Data Table**")
@@ -818,67 +1085,81 @@ with tab2:
             "LOCATION", "ITEM", "CLOSING_STOCK", "TB_CASES_ACTIVE",
             "LEAD_TIME_DAYS", "DAYS_OF_THERAPY_LEFT", "DAYS_UNTIL_STOCKOUT_VS_LEAD",
             "TB_RISK_SCORE", "PROGRAMMATIC_RISK", "SUGGESTED_REORDER_QTY"
-        ]].copy()
-        
-        alert_export.columns = [
-            "Province", "Treatment Regimen", "Current Stock", "Active Cases",
-            "Lead Time (Days)", "Supply Days Left", "Shortfall (Days)",
-            "TB Risk Score", "Programmatic Risk", "Recommended Order Quantity"
-        ]
+        ]].rename(columns={
+            "LOCATION": "Province",
+            "ITEM": "Treatment Regimen",
+            "CLOSING_STOCK": "Current Stock",
+            "TB_CASES_ACTIVE": "Active Cases",
+            "LEAD_TIME_DAYS": "Lead Time (Days)",
+            "DAYS_OF_THERAPY_LEFT": "Supply Days Left",
+            "DAYS_UNTIL_STOCKOUT_VS_LEAD": "Shortfall (Days)",
+            "TB_RISK_SCORE": "TB Risk Score",
+            "PROGRAMMATIC_RISK": "Programmatic Risk",
+            "SUGGESTED_REORDER_QTY": "Recommended Order Quantity",
+        })
         
         st.dataframe(alert_export, use_container_width=True, height=400)
         
         # Download functionality
-        csv = alert_export.to_csv(index=False).encode('utf-8')
-        st.download_button(
-            label="Download Priority Procurement List (CSV)",
-            data=csv,
-            file_name=f"tb_critical_procurement_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-            mime="text/csv",
-            help="Export comprehensive alert data for procurement teams and supply chain management"
-        )
+        export_name = f"tb_critical_procurement_{datetime.now().strftime('%Y%m%d_%H%M')}"
+        col_csv, col_gz = st.columns(2)
+        with col_csv:
+            st.download_button(
+                label="Download Priority Procurement List (CSV)",
+                data=alerts_csv(alert_export),
+                file_name=f"{export_name}.csv",
+                mime="text/csv",
+                help="Export comprehensive alert data for procurement teams and supply chain management"
+            )
+        with col_gz:
+            st.download_button(
+                label="Download Compressed (CSV.GZ)",
+                data=alerts_csv_gz(alert_export),
+                file_name=f"{export_name}.csv.gz",
+                mime="application/gzip",
+                help="Same list gzip-compressed, for low-bandwidth connections"
+            )
     
     # Warning items section
     st.markdown("**Items Approaching Critical Threshold**")
     st.caption("Monitor these items closely for potential stockout risk in the near future")
     
-    warnings = filtered_latest[
-        (filtered_latest["DAYS_UNTIL_STOCKOUT_VS_LEAD"] >= 0) & 
-        (filtered_latest["STOCK_RISK_FLAG"] == True)
-    ].sort_values("DAYS_OF_THERAPY_LEFT")
+    # Partial selection of the ten shortest supplies instead of sorting every warning row
+    top_warnings = filtered_latest[warning_mask].nsmallest(10, "DAYS_OF_THERAPY_LEFT")
     
-    if not warnings.empty:
-        for idx, r in warnings.head(10).iterrows():
-            st.markdown(f"""
-            <div class="alert alert-warning">
-                <div class="alert-content">
-                    <strong>{r['LOCATION']} — {r['ITEM']}</strong><br>
-                    Supply remaining: {r['DAYS_OF_THERAPY_LEFT']:.1f} days | 
-                    Lead time: {int(r['LEAD_TIME_DAYS'])} days | 
-                    Active cases: {int(r['TB_CASES_ACTIVE'])} | 
-                    Recommended order: {int(r['SUGGESTED_REORDER_QTY'])} units
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
+    if not top_warnings.empty:
+        warning_cards = [
+            WARNING_CARD_TEMPLATE.format(
+                location=location, item=item, days_left=days_left,
+                lead_time=lead_time, cases=cases, reorder_qty=reorder_qty,
+            )
+            for location, item, days_left, lead_time, cases, reorder_qty in zip(
+                top_warnings["LOCATION"].to_numpy(),
+                top_warnings["ITEM"].to_numpy(),
+                top_warnings["DAYS_OF_THERAPY_LEFT"].to_numpy(),
+                whole_counts(top_warnings["LEAD_TIME_DAYS"], " days"),
+                whole_counts(top_warnings["TB_CASES_ACTIVE"]),
+                whole_counts(top_warnings["SUGGESTED_REORDER_QTY"], " units"),
+            )
+        ]
+        st.markdown("".join(warning_cards), unsafe_allow_html=True)
     else:
         st.info("No items currently in warning threshold range")
 
 # --------- TAB 3: Care Cascade ---------
-with tab3:
+@st.fragment
+def render_cascade_tab(selected_locations):
+    """Care cascade delay composition and summary statistics"""
     st.markdown('<h2 class="section-header">Treatment Cascade Time Analysis</h2>', unsafe_allow_html=True)
     
-    # Filter cascade data based on selected provinces
-    cascade_filtered = cascade_df[cascade_df["LOCATION"].isin(selected_locations)].copy()
+    # Loaded and filtered here rather than upfront so the first paint only waits on stock health;
+    # cached on the selection alone, so reruns with the same provinces skip hashing the raw table
+    cascade_view = cascade_summary(selected_locations)
+    cascade_filtered = cascade_view["filtered"]
     
     if len(cascade_filtered) == 0:
         st.warning("No data available for selected provinces. Please adjust your filters.")
     else:
-        cascade_filtered["total_delay_days"] = (
-            cascade_filtered["MEDIAN_PATIENT_DELAY_DAYS"]
-            + cascade_filtered["MEDIAN_DIAGNOSTIC_DELAY_DAYS"]
-            + cascade_filtered["MEDIAN_TREATMENT_DELAY_DAYS"]
-        )
-        
         st.markdown("""
         <div class="info-box">
             <div class="info-box-title">Care Cascade Metrics Overview</div>
@@ -888,235 +1169,105 @@ with tab3:
         """, unsafe_allow_html=True)
         
         # Stacked bar visualization - FILTERED
-        fig_cascade = go.Figure()
-        
-        fig_cascade.add_trace(go.Bar(
-            x=cascade_filtered["LOCATION"],
-            y=cascade_filtered["MEDIAN_PATIENT_DELAY_DAYS"],
-            name="Patient Delay",
-            marker_color=COLORS['primary'],
-            hovertemplate='<b>%{x}</b><br>Patient Delay: %{y:.1f} days<extra></extra>'
-        ))
-        
-        fig_cascade.add_trace(go.Bar(
-            x=cascade_filtered["LOCATION"],
-            y=cascade_filtered["MEDIAN_DIAGNOSTIC_DELAY_DAYS"],
-            name="Diagnostic Delay",
-            marker_color=COLORS['secondary'],
-            hovertemplate='<b>%{x}</b><br>Diagnostic Delay: %{y:.1f} days<extra></extra>'
-        ))
-        
-        fig_cascade.add_trace(go.Bar(
-            x=cascade_filtered["LOCATION"],
-            y=cascade_filtered["MEDIAN_TREATMENT_DELAY_DAYS"],
-            name="Treatment Initiation Delay",
-            marker_color=COLORS['warning'],
-            hovertemplate='<b>%{x}</b><br>Treatment Delay: %{y:.1f} days<extra></extra>'
-        ))
-        
-        fig_cascade.update_layout(
-            barmode='stack',
-            xaxis_title="Province",
-            yaxis_title="Delay Duration (Days)",
-            height=500,
-            title={
-                'text': "Care Cascade Delay Composition by Province",
-                'x': 0.5,
-                'xanchor': 'center',
-                'font': {'size': 16, 'color': COLORS['primary'], 'family': 'Inter'}
-            },
-            hovermode='x unified',
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="center",
-                x=0.5
-            ),
-            paper_bgcolor='white',
-            plot_bgcolor='white',
-            font=dict(family='Inter', size=11)
-        )
+        fig_cascade = build_cascade_chart(selected_locations)
         
-        fig_cascade.update_xaxes(tickangle=45)
-        
-        st.plotly_chart(fig_cascade, use_container_width=True)
+        st.plotly_chart(fig_cascade, use_container_width=True, key="cascade_stages")
         
         # Analytics columns
         col1, col2 = st.columns(2)
         
         with col1:
             st.markdown("**Provincial Delay Statistics (Filtered)**")
-            cascade_display = cascade_filtered[[
-                "LOCATION", "MEDIAN_PATIENT_DELAY_DAYS", 
-                "MEDIAN_DIAGNOSTIC_DELAY_DAYS", "MEDIAN_TREATMENT_DELAY_DAYS",
-                "total_delay_days"
-            ]].copy()
-            
-            cascade_display.columns = [
-                "Province", "Patient Delay (Days)", "Diagnostic Delay (Days)", 
-                "Treatment Delay (Days)", "Total Delay (Days)"
-            ]
-            
-            st.dataframe(cascade_display, use_container_width=True, height=400)
+            # Labels come from column_config, so the cached frame is shown without a renamed copy
+            st.dataframe(
+                page_rows(cascade_view["table"], key="cascade_page"),
+                column_order=["LOCATION", *DELAY_COLUMNS, "TOTAL_DELAY_DAYS"],
+                column_config={
+                    "LOCATION": st.column_config.TextColumn("Province"),
+                    "MEDIAN_PATIENT_DELAY_DAYS": st.column_config.NumberColumn("Patient Delay (Days)"),
+                    "MEDIAN_DIAGNOSTIC_DELAY_DAYS": st.column_config.NumberColumn("Diagnostic Delay (Days)"),
+                    "MEDIAN_TREATMENT_DELAY_DAYS": st.column_config.NumberColumn("Treatment Delay (Days)"),
+                    "TOTAL_DELAY_DAYS": st.column_config.NumberColumn("Total Delay (Days)"),
+                },
+                use_container_width=True,
+                height=400
+            )
         
         with col2:
             st.markdown("**Average Delays by Stage (Filtered Provinces)**")
-            avg_delays = pd.DataFrame({
-                'Cascade Stage': ['Patient Delay', 'Diagnostic Delay', 'Treatment Initiation'],
-                'Average Duration (Days)': [
-                    cascade_filtered["MEDIAN_PATIENT_DELAY_DAYS"].mean(),
-                    cascade_filtered["MEDIAN_DIAGNOSTIC_DELAY_DAYS"].mean(),
-                    cascade_filtered["MEDIAN_TREATMENT_DELAY_DAYS"].mean()
-                ]
-            })
-            
-            fig_avg = px.bar(
-                avg_delays,
-                x='Cascade Stage',
-                y='Average Duration (Days)',
-                color='Cascade Stage',
-                color_discrete_sequence=[COLORS['primary'], COLORS['secondary'], COLORS['warning']],
-                text='Average Duration (Days)'
-            )
-            fig_avg.update_traces(texttemplate='%{text:.1f}', textposition='outside')
-            fig_avg.update_layout(
-                height=350, 
-                showlegend=False,
-                paper_bgcolor='white',
-                plot_bgcolor='white',
-                font=dict(family='Inter', size=11)
-            )
-            st.plotly_chart(fig_avg, use_container_width=True)
+            fig_avg = build_stage_delay_chart(selected_locations)
+            st.plotly_chart(fig_avg, use_container_width=True, key="cascade_avg_delays")
             
             # Summary statistics - FILTERED
-            st.markdown(f"""
-            <div class="stats-card">
-                <div class="stats-title">Filtered Provinces Summary</div>
-                <div class="stats-grid">
-                    <div class="stat-item">
-                        <div class="stat-label">Mean Total Delay</div>
-                        <div class="stat-value">{cascade_filtered['total_delay_days'].mean():.1f}</div>
-                    </div>
-                    <div class="stat-item">
-                        <div class="stat-label">Median Total Delay</div>
-                        <div class="stat-value">{cascade_filtered['total_delay_days'].median():.1f}</div>
-                    </div>
-                    <div class="stat-item">
-                        <div class="stat-label">Minimum Delay</div>
-                        <div class="stat-value">{cascade_filtered['total_delay_days'].min():.1f}</div>
-                    </div>
-                    <div class="stat-item">
-                        <div class="stat-label">Maximum Delay</div>
-                        <div class="stat-value">{cascade_filtered['total_delay_days'].max():.1f}</div>
-                    </div>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
+            st.markdown(cascade_stats_html(cascade_view["total_stats"]), unsafe_allow_html=True)
 
 # --------- TAB 4: Provider Network ---------
-with tab4:
+@st.fragment
+def render_provider_tab(selected_locations, selected_items):
+    """Provider capacity charts and facility directory"""
     st.markdown('<h2 class="section-header">Healthcare Provider Network Analysis</h2>', unsafe_allow_html=True)
     
-    # Filter provider data by selected provinces
-    prov_filtered = prov_df[prov_df["LOCATION"].isin(selected_locations)].copy()
+    # Filter provider data by selected provinces (cached on the selection with the per-province capacity table)
+    provider_view = provider_summary(selected_locations, selected_items)
+    prov_filtered = provider_view["filtered"]
     
     if len(prov_filtered) == 0:
         st.warning("No provider data available for selected provinces. Please adjust your filters.")
     else:
-        prov_summary = prov_filtered.groupby("LOCATION").agg(
-            facilities=("FACILITY_ID", "nunique"),
-            total_doctors=("DOCTOR_COUNT", "sum")
-        ).reset_index()
-        
-        prov_with_cases = prov_summary.merge(
-            filtered_latest.groupby("LOCATION")["TB_CASES_ACTIVE"].sum().reset_index(),
-            on="LOCATION",
-            how="left"
-        )
-        prov_with_cases["patients_per_doctor"] = (
-            prov_with_cases["TB_CASES_ACTIVE"] / prov_with_cases["total_doctors"]
-        )
-        
         col1, col2 = st.columns(2)
         
         with col1:
             st.markdown("**Healthcare Infrastructure Distribution (Filtered)**")
-            fig_providers = go.Figure()
-            fig_providers.add_trace(go.Bar(
-                x=prov_with_cases["LOCATION"],
-                y=prov_with_cases["facilities"],
-                name="Healthcare Facilities",
-                marker_color=COLORS['primary']
-            ))
-            fig_providers.add_trace(go.Bar(
-                x=prov_with_cases["LOCATION"],
-                y=prov_with_cases["total_doctors"],
-                name="Medical Practitioners",
-                marker_color=COLORS['success']
-            ))
-            fig_providers.update_layout(
-                barmode='group',
-                height=400,
-                xaxis_title="Province",
-                yaxis_title="Count",
-                paper_bgcolor='white',
-                plot_bgcolor='white',
-                font=dict(family='Inter', size=11),
-                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5)
-            )
-            fig_providers.update_xaxes(tickangle=45)
-            st.plotly_chart(fig_providers, use_container_width=True)
+            fig_providers = build_provider_capacity_chart(selected_locations, selected_items)
+            st.plotly_chart(fig_providers, use_container_width=True, key="prov_infrastructure")
         
         with col2:
             st.markdown("**Patient-to-Doctor Ratio Analysis (Filtered)**")
-            fig_ratio = px.bar(
-                prov_with_cases,
-                x="LOCATION",
-                y="patients_per_doctor",
-                color="patients_per_doctor",
-                color_continuous_scale=[[0, COLORS['success']], [1, COLORS['danger']]],
-                labels={"patients_per_doctor": "Ratio", "LOCATION": "Province"}
-            )
-            fig_ratio.update_layout(
-                height=400,
-                showlegend=False,
-                paper_bgcolor='white',
-                plot_bgcolor='white',
-                font=dict(family='Inter', size=11),
-                yaxis_title="Patients per Doctor"
-            )
-            fig_ratio.update_xaxes(tickangle=45)
-            st.plotly_chart(fig_ratio, use_container_width=True)
+            fig_ratio = build_patient_ratio_chart(selected_locations, selected_items)
+            st.plotly_chart(fig_ratio, use_container_width=True, key="prov_ratio")
         
         st.markdown("**Provincial Healthcare Capacity Summary (Filtered)**")
-        prov_with_cases.columns = ["Province", "Healthcare Facilities", "Medical Practitioners", "Active TB Patients", "Patient-Doctor Ratio"]
-        st.dataframe(prov_with_cases, use_container_width=True, height=350)
+        st.dataframe(
+            provider_view["by_province_table"],
+            column_config={
+                "LOCATION": st.column_config.TextColumn("Province"),
+                "facilities": st.column_config.NumberColumn("Healthcare Facilities", format="%d"),
+                "total_doctors": st.column_config.NumberColumn("Medical Practitioners", format="%d"),
+                "TB_CASES_ACTIVE": st.column_config.NumberColumn("Active TB Patients", format="%d"),
+                "patients_per_doctor": st.column_config.NumberColumn("Patient-Doctor Ratio"),
+            },
+            use_container_width=True,
+            height=350
+        )
         
         st.markdown("---")
         st.markdown("**Detailed Facility Directory and Incentive Programs (Filtered)**")
         st.caption("Comprehensive listing of TB treatment facilities and performance-based compensation structures")
         
-        facility_display = prov_filtered[[
-            "FACILITY_NAME", "LOCATION", "DOCTOR_COUNT", "INCENTIVE_SCHEME"
-        ]].copy()
-        facility_display.columns = ["Facility Name", "Province", "Medical Practitioners", "Incentive Program"]
-        
-        st.dataframe(facility_display, use_container_width=True, height=400)
+        st.dataframe(
+            page_rows(provider_view["table"], key="facility_page"),
+            column_order=["FACILITY_NAME", "LOCATION", "DOCTOR_COUNT", "INCENTIVE_SCHEME"],
+            column_config={
+                "FACILITY_NAME": st.column_config.TextColumn("Facility Name"),
+                "LOCATION": st.column_config.TextColumn("Province"),
+                "DOCTOR_COUNT": st.column_config.NumberColumn("Medical Practitioners", format="%d"),
+                "INCENTIVE_SCHEME": st.column_config.TextColumn("Incentive Program"),
+            },
+            use_container_width=True,
+            height=400
+        )
 
 # --------- TAB 5: Distribution Network ---------
-with tab5:
+@st.fragment
+def render_distribution_tab(selected_locations):
+    """Depot map, inventory levels and regional breakdown"""
     st.markdown('<h2 class="section-header">Pharmaceutical Distribution Network</h2>', unsafe_allow_html=True)
     
-    st.markdown("""
-    <div class="info-box">
-        <div class="info-box-title">National Distribution Infrastructure</div>
-        <p>Strategic depot locations form the backbone of Indonesia's TB pharmaceutical supply chain, managing inventory flow from central procurement to provincial healthcare facilities.</p>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(INFO_BOX_DEPOT_HTML, unsafe_allow_html=True)
     
-    # Filter depots by selected provinces
-    depots_filtered = depots_df[depots_df["LOCATION"].isin(selected_locations)].copy()
+    # Filter depots by selected provinces (cached on the selection with the regional breakdown)
+    depot_view = depot_summary(selected_locations)
+    depots_filtered = depot_view["filtered"]
     
     if len(depots_filtered) == 0:
         st.warning("No depot data available for selected provinces. Please adjust your filters.")
@@ -1124,81 +1275,42 @@ with tab5:
         if 'LATITUDE' in depots_filtered.columns and 'LONGITUDE' in depots_filtered.columns:
             st.markdown("**Geographic Distribution of Pharmaceutical Depots (Filtered)**")
             
-            fig_map = px.scatter_mapbox(
-                depots_filtered,
-                lat="LATITUDE",
-                lon="LONGITUDE",
-                hover_name="DEPOT_NAME",
-                hover_data={"LOCATION": True, "REGION": True, "STOCK_LEVEL": True, "LATITUDE": False, "LONGITUDE": False},
-                color="STOCK_LEVEL",
-                size="STOCK_LEVEL",
-                color_continuous_scale=[[0, COLORS['danger']], [0.5, COLORS['warning']], [1, COLORS['success']]],
-                zoom=4,
-                height=600
-            )
-            fig_map.update_layout(
-                mapbox_style="open-street-map",
-                paper_bgcolor='white',
-                font=dict(family='Inter', size=11)
-            )
-            st.plotly_chart(fig_map, use_container_width=True)
+            depot_deck = build_depot_map(selected_locations)
+            # The key names the element and keeps its id unique. Streamlit 1.39 still hashes the
+            # deck spec into the id, so new depot data remounts the map; only newer releases
+            # (key_as_main_identity) identify a keyed deck by its key alone
+            st.pydeck_chart(depot_deck, use_container_width=True, height=600, key="depot_map")
+            st.caption("Marker size and colour scale with stock level: red is lowest, green is highest.")
         
         col1, col2 = st.columns(2)
         
         with col1:
             st.markdown("**Depot Inventory Levels (Filtered)**")
-            fig_depot_stock = px.bar(
-                depots_filtered.sort_values("STOCK_LEVEL", ascending=False),
-                x="DEPOT_NAME",
-                y="STOCK_LEVEL",
-                color="REGION",
-                labels={"STOCK_LEVEL": "Inventory Level (Units)", "DEPOT_NAME": "Depot Facility"}
-            )
-            fig_depot_stock.update_layout(
-                height=400,
-                paper_bgcolor='white',
-                plot_bgcolor='white',
-                font=dict(family='Inter', size=11)
-            )
-            fig_depot_stock.update_xaxes(tickangle=45)
-            st.plotly_chart(fig_depot_stock, use_container_width=True)
+            fig_depot_stock = build_depot_stock_chart(selected_locations)
+            st.plotly_chart(fig_depot_stock, use_container_width=True, key="depot_stock")
         
         with col2:
             st.markdown("**Regional Distribution Analysis (Filtered)**")
-            regional_stats = depots_filtered.groupby("REGION").agg({
-                "DEPOT_ID": "count",
-                "STOCK_LEVEL": "sum"
-            }).reset_index()
-            regional_stats.columns = ["Region", "Number of Depots", "Total Inventory"]
-            
-            fig_regional = px.pie(
-                regional_stats,
-                values="Number of Depots",
-                names="Region",
-                hole=0.5
-            )
-            fig_regional.update_traces(textposition='inside', textinfo='percent+label')
-            fig_regional.update_layout(
-                height=400,
-                paper_bgcolor='white',
-                font=dict(family='Inter', size=11)
-            )
-            st.plotly_chart(fig_regional, use_container_width=True)
+            fig_regional = build_regional_chart(selected_locations)
+            st.plotly_chart(fig_regional, use_container_width=True, key="regional_pie")
         
         st.markdown("**Complete Depot Directory (Filtered)**")
-        st.dataframe(depots_filtered, use_container_width=True, height=350)
+        st.dataframe(page_rows(depot_view["table"], key="depot_page"), use_container_width=True, height=350)
+
+# --------- Render Active Section ---------
+# Each section body is a fragment: widgets inside a section (the download buttons) rerun only
+# that section, while sidebar changes still rerun the whole script
+if active_section == "Inventory Analysis":
+    render_inventory_tab(selected_locations, selected_items, stockout_count, warning_count, adequate_count)
+elif active_section == "Critical Alerts":
+    render_alerts_tab(filtered_latest, stockout_mask, warning_mask)
+elif active_section == "Care Cascade":
+    render_cascade_tab(selected_locations)
+elif active_section == "Provider Network":
+    render_provider_tab(selected_locations, selected_items)
+elif active_section == "Distribution System":
+    render_distribution_tab(selected_locations)
 
 # --------- Footer ---------
 st.markdown("---")
-st.markdown("""
-<div style="text-align: center; color: #64748b; padding: 2.5rem 1rem; background: white; border-radius: 12px; margin-top: 3rem;">
-    <p style="font-size: 1.1rem; font-weight: 600; color: #1e40af; margin-bottom: 0.5rem;">TB CareMap Indonesia</p>
-    <p style="font-size: 0.9rem; margin: 0.25rem 0;">National Tuberculosis Inventory Management System</p>
-    <p style="font-size: 0.85rem; color: #94a3b8; margin-top: 1rem;">
-        Powered by Snowflake Data Cloud Platform • Built with Streamlit Framework
-    </p>
-    <p style="font-size: 0.8rem; color: #cbd5e1; margin-top: 0.75rem;">
-        Note: All displayed data is synthetic and generated for demonstration and educational purposes only
-    </p>
-</div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+st.markdown(FOOTER_HTML, unsafe_allow_html=True)
\ No newline at end of file